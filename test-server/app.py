@@ -1,10 +1,31 @@
-from flask import Flask, request, jsonify
+# gevent 必須在匯入 pika 和其他網路相關模組之前完成 monkey patch
+from gevent import monkey
+monkey.patch_all()
+
+from flask import Flask, Response, request, jsonify
 import pika
+import gzip
 import json
+import msgpack
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson 時退回標準庫 json
+    orjson = None
 import os
+import time
 import uuid
-import base64
-from datetime import datetime
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError, wait
+from datetime import datetime, timezone
+from typing import Any, List, Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
 import logging
 
 # 配置日誌
@@ -13,6 +34,11 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# 上傳大小上限 (位元組)，需小於 broker 的 max_message_size。
+# 超過 500KB 的上傳由 werkzeug 暫存到磁碟，而不是保留在記憶體中
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 64 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
 # RabbitMQ 連接配置
 RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST', 'localhost')
 RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', 5672))
@@ -20,94 +46,195 @@ RABBITMQ_USER = os.environ.get('RABBITMQ_USER', 'guest')
 RABBITMQ_PASS = os.environ.get('RABBITMQ_PASS', 'guest')
 RABBITMQ_VHOST = os.environ.get('RABBITMQ_VHOST', '/')
 
+# 批次發布配置：收集最多 BATCH_MAX_MESSAGES 筆或等待 BATCH_MAX_DELAY_MS 毫秒後一次發送
+BATCH_MAX_MESSAGES = int(os.environ.get('BATCH_MAX_MESSAGES', 100))
+BATCH_MAX_DELAY = float(os.environ.get('BATCH_MAX_DELAY_MS', 5)) / 1000
+PUBLISH_TIMEOUT = float(os.environ.get('PUBLISH_TIMEOUT', 10))
+RECONNECT_DELAY = 1
+
+# 消息序列化格式: json (預設，回測伺服器以 JSON 解析消息) 或 msgpack
+SERIALIZATION = os.environ.get('SERIALIZATION', 'json')
+if SERIALIZATION not in ('json', 'msgpack'):
+    raise ValueError(f"不支援的序列化格式: {SERIALIZATION}")
+
+# 消息內容達到此大小 (位元組) 時以 gzip 壓縮，0 表示停用 (回測伺服器目前不解壓縮)
+COMPRESS_THRESHOLD = int(os.environ.get('COMPRESS_THRESHOLD', 0))
+COMPRESS_LEVEL = 3
+
+# Prometheus 指標 (gunicorn 多 worker 時設定 PROMETHEUS_MULTIPROC_DIR 以彙總所有 worker)
+MESSAGES_PUBLISHED = Counter(
+    'amqp_messages_published_total', '已送出到 broker 的消息數'
+)
+MESSAGES_CONFIRMED = Counter(
+    'amqp_messages_confirmed_total', '已收到 broker 確認結果的消息數', ['result']
+)
+PUBLISH_BATCH_SIZE = Histogram(
+    'amqp_publish_batch_size', '每輪批次發送的消息數',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+PUBLISH_CONFIRM_SECONDS = Histogram(
+    'amqp_publish_confirm_seconds', '消息從建立到收到 broker 確認的時間'
+)
+UNCONFIRMED_MESSAGES = Gauge(
+    'amqp_unconfirmed_messages', '已送出但尚未確認的消息數', multiprocess_mode='livesum'
+)
+CONNECTIONS_OPENED = Counter(
+    'amqp_connections_opened_total', '已建立的 RabbitMQ 連接數'
+)
+CONNECTION_ERRORS = Counter(
+    'amqp_connection_errors_total', 'RabbitMQ 連接失敗或中斷次數'
+)
+
 # 交換機和隊列配置
 EXCHANGE_NAME = 'backtest_exchange'
 BACKTEST_QUEUE = 'backtest_queue'
 STRATEGY_QUEUE = 'strategy_queue'
 DATA_QUEUE = 'data_queue'
+FILE_QUEUE = 'file_queue'
 
-# 建立 RabbitMQ 連接
-def get_rabbitmq_connection():
-    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-    parameters = pika.ConnectionParameters(
-        host=RABBITMQ_HOST,
-        port=RABBITMQ_PORT,
-        virtual_host=RABBITMQ_VHOST,
-        credentials=credentials,
-        heartbeat=600,
-        blocked_connection_timeout=300
-    )
-    return pika.BlockingConnection(parameters)
+# RabbitMQ 連接參數 (不會變動，啟動時建立一次，重新連接時沿用)
+RABBITMQ_CREDENTIALS = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+RABBITMQ_CONNECTION_PARAMETERS = pika.ConnectionParameters(
+    host=RABBITMQ_HOST,
+    port=RABBITMQ_PORT,
+    virtual_host=RABBITMQ_VHOST,
+    credentials=RABBITMQ_CREDENTIALS,
+    heartbeat=600,
+    blocked_connection_timeout=300
+)
 
-# 初始化 RabbitMQ 連接和通道
-def initialize_rabbitmq():
-    try:
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        
-        # 宣告交換機
-        channel.exchange_declare(
-            exchange=EXCHANGE_NAME,
-            exchange_type='topic',
-            durable=True
-        )
-        
-        # 宣告隊列
-        channel.queue_declare(queue=BACKTEST_QUEUE, durable=True)
-        channel.queue_declare(queue=STRATEGY_QUEUE, durable=True)
-        channel.queue_declare(queue=DATA_QUEUE, durable=True)
-        
-        # 綁定隊列到交換機
-        channel.queue_bind(
-            exchange=EXCHANGE_NAME,
-            queue=BACKTEST_QUEUE,
-            routing_key='backtest.*'
-        )
-        channel.queue_bind(
-            exchange=EXCHANGE_NAME,
-            queue=STRATEGY_QUEUE,
-            routing_key='strategy.*'
-        )
-        channel.queue_bind(
-            exchange=EXCHANGE_NAME,
-            queue=DATA_QUEUE,
-            routing_key='data.*'
-        )
-        
-        logger.info("RabbitMQ 初始化成功")
-        return connection, channel
-    except Exception as e:
-        logger.error(f"RabbitMQ 初始化失敗: {str(e)}")
-        raise
+# 所有消息共用的 AMQP 屬性
+BASE_MESSAGE_PROPERTIES = {
+    "delivery_mode": 2  # 持久化消息
+}
+
+# 宣告交換機、隊列和綁定
+def declare_topology(channel):
+    # 宣告交換機
+    channel.exchange_declare(
+        exchange=EXCHANGE_NAME,
+        exchange_type='topic',
+        durable=True
+    )
+    
+    # 宣告隊列
+    channel.queue_declare(queue=BACKTEST_QUEUE, durable=True)
+    channel.queue_declare(queue=STRATEGY_QUEUE, durable=True)
+    channel.queue_declare(queue=DATA_QUEUE, durable=True)
+    channel.queue_declare(queue=FILE_QUEUE, durable=True)
+    
+    # 綁定隊列到交換機
+    channel.queue_bind(
+        exchange=EXCHANGE_NAME,
+        queue=BACKTEST_QUEUE,
+        routing_key='backtest.*'
+    )
+    channel.queue_bind(
+        exchange=EXCHANGE_NAME,
+        queue=STRATEGY_QUEUE,
+        routing_key='strategy.*'
+    )
+    channel.queue_bind(
+        exchange=EXCHANGE_NAME,
+        queue=DATA_QUEUE,
+        routing_key='data.*'
+    )
+    channel.queue_bind(
+        exchange=EXCHANGE_NAME,
+        queue=FILE_QUEUE,
+        routing_key='file.*'
+    )
 
 # 生成唯一消息 ID
 def generate_message_id():
     return str(uuid.uuid4())
 
+# 待發送的消息：以 dict 保存消息欄位，並快取編碼後的內容和 AMQP 屬性，
+# 重試或發送到多個 routing key 時不必重新序列化 (編碼後不應再修改消息欄位)
+class OutboundMessage(dict):
+    __slots__ = ('created_ns', 'body', 'properties')
+
+    def __init__(self, fields, created_ns):
+        super().__init__(fields)
+        self.created_ns = created_ns
+        self.body = None
+        self.properties = None
+
 # 建立通用消息格式
+# 消息 ID 和建立時間各只產生一次；未指定 correlation_id 時沿用消息 ID
 def create_message(msg_type, payload, correlation_id=None):
-    return {
-        "message_id": generate_message_id(),
+    message_id = generate_message_id()
+    created_ns = time.time_ns()
+    return OutboundMessage({
+        "message_id": message_id,
         "message_type": msg_type,
-        "timestamp": datetime.now().isoformat(),
-        "correlation_id": correlation_id or generate_message_id(),
+        "timestamp": datetime.fromtimestamp(created_ns / 1_000_000_000, tz=timezone.utc),
+        "correlation_id": correlation_id or message_id,
         "payload": payload
-    }
+    }, created_ns)
+
+# 序列化器無法直接處理的型別 (orjson 原生支援 datetime)
+def encode_default(obj):
+    if isinstance(obj, datetime):
+        # 與 orjson 的 OPT_UTC_Z 相同，UTC 時間以 RFC 3339 的 Z 結尾，格式不因序列化器而異
+        text = obj.isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    raise TypeError(f"無法序列化的型別: {type(obj).__name__}")
+
+# 依設定的格式序列化消息，回傳 (body, content_type)
+def serialize_message(message):
+    if SERIALIZATION == 'msgpack':
+        return msgpack.packb(message, use_bin_type=True, default=encode_default), 'application/msgpack'
+    if orjson is not None:
+        return orjson.dumps(message, default=encode_default, option=orjson.OPT_UTC_Z), 'application/json'
+    return json.dumps(message, default=encode_default).encode('utf-8'), 'application/json'
+
+# 內容超過門檻時壓縮，回傳 (body, content_encoding)；小內容壓縮後反而變大，維持原樣
+def compress_body(body):
+    if not COMPRESS_THRESHOLD or len(body) < COMPRESS_THRESHOLD:
+        return body, None
+    compressed = gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+    if len(compressed) >= len(body):
+        return body, None
+    return compressed, 'gzip'
+
+# 編碼消息內容和 AMQP 屬性，結果快取在消息上，回傳 (body, properties)
+# 提供 body 時直接以原始位元組作為消息內容，其餘消息欄位改放在 headers
+def encode_message(message, body=None):
+    if message.body is not None:
+        return message.body, message.properties
+    if body is None:
+        body, content_type = serialize_message(message)
+        headers = None
+    else:
+        content_type = 'application/octet-stream'
+        headers = {
+            "message_type": message['message_type'],
+            "timestamp": message['timestamp'],
+            **message['payload']
+        }
+    message.body, content_encoding = compress_body(body)
+    message.properties = pika.BasicProperties(
+        **BASE_MESSAGE_PROPERTIES,
+        content_type=content_type,
+        content_encoding=content_encoding,
+        message_id=message['message_id'],
+        correlation_id=message['correlation_id'],
+        timestamp=message.created_ns // 1_000_000_000,
+        headers=headers
+    )
+    return message.body, message.properties
 
-# 發送消息到 RabbitMQ
-def send_message(channel, routing_key, message):
+# 發送消息到 RabbitMQ (mandatory: 無法路由的消息會被 broker 退回)
+def send_message(channel, routing_key, message, body=None):
     try:
+        body, properties = encode_message(message, body)
         channel.basic_publish(
             exchange=EXCHANGE_NAME,
             routing_key=routing_key,
-            body=json.dumps(message),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # 持久化消息
-                content_type='application/json',
-                message_id=message['message_id'],
-                correlation_id=message['correlation_id'],
-                timestamp=int(datetime.now().timestamp())
-            )
+            body=body,
+            properties=properties,
+            mandatory=True
         )
         logger.info(f"消息已發送: {routing_key} -> {message['message_id']}")
         return True
@@ -115,8 +242,257 @@ def send_message(channel, routing_key, message):
         logger.error(f"發送消息失敗: {str(e)}")
         return False
 
+# 批次發布器：背景執行緒執行 SelectConnection 的 IOLoop，是行程中唯一使用 RabbitMQ 連接的執行緒。
+# 發布請求在 BATCH_MAX_DELAY 窗口內累積後一次發送 (每輪最多 BATCH_MAX_MESSAGES 筆)；
+# 通道啟用 publisher confirms，發送時不逐筆等待確認，broker 以 ack 確認後才以 True 完成對應的 Future，
+# nack 或被退回的消息以 False 完成。連接中斷時未確認的消息在重新連接後重送一次。
+#
+# 拓撲在每次開啟發布通道時宣告一次 (宣告是冪等的)，不在每個請求中重複宣告，
+# 因此被刪除的隊列或新增的綁定會在下次連接時補上。
+# broker 端另需在 rabbitmq.conf 設定: consumer_timeout 大於最長的回測執行時間，
+# 以及 vm_memory_high_watermark / disk_free_limit；觸發流量控制時發布會被阻塞，
+# 最長等待 blocked_connection_timeout 秒
+class BatchPublisher:
+    def __init__(self, max_messages=BATCH_MAX_MESSAGES, max_delay=BATCH_MAX_DELAY):
+        self._max_messages = max_messages
+        self._max_delay = max_delay
+        # 每筆發布請求為 [routing_key, message, body, future, 已重送次數]
+        self._pending = queue.Queue()
+        self._retry = deque()
+        self._lock = threading.Lock()
+        self._flush_scheduled = False
+        self._connection = None
+        self._channel = None
+        self._delivery_tag = 0
+        self._unconfirmed = OrderedDict()
+        self._returned = set()
+        self._thread = threading.Thread(target=self._run, name='batch-publisher', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, routing_key, message, body=None):
+        future = Future()
+        self._pending.put([routing_key, message, body, future, 0])
+        self._request_flush()
+        return future
+
+    # 可由任意執行緒呼叫，請 IOLoop 在批次窗口結束後發送累積的消息
+    def _request_flush(self):
+        with self._lock:
+            if self._flush_scheduled or self._connection is None:
+                return
+            self._flush_scheduled = True
+            connection = self._connection
+        try:
+            connection.ioloop.add_callback_threadsafe(
+                lambda: connection.ioloop.call_later(self._max_delay, self._flush)
+            )
+        except Exception as e:
+            logger.warning(f"無法排程批次發送: {str(e)}")
+            with self._lock:
+                self._flush_scheduled = False
+
+    def _run(self):
+        while True:
+            connection = pika.SelectConnection(
+                RABBITMQ_CONNECTION_PARAMETERS,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed
+            )
+            with self._lock:
+                self._connection = connection
+            connection.ioloop.start()
+            with self._lock:
+                self._connection = None
+                self._flush_scheduled = False
+            time.sleep(RECONNECT_DELAY)
+
+    def _on_connection_open(self, connection):
+        CONNECTIONS_OPENED.inc()
+        connection.channel(on_open_callback=self._on_setup_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        logger.error(f"RabbitMQ 連接失敗: {str(error)}")
+        CONNECTION_ERRORS.inc()
+        # 連接不上時讓等待中的請求立即失敗，而不是等到逾時
+        self._fail_waiting()
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        logger.warning(f"RabbitMQ 連接中斷: {str(reason)}")
+        CONNECTION_ERRORS.inc()
+        self._channel = None
+        self._requeue_unconfirmed()
+        connection.ioloop.stop()
+
+    def _on_setup_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        # 未提供回呼時 pika 以 nowait 送出宣告，broker 依序處理同一通道的命令，
+        # 因此 confirm_delivery 的回應表示拓撲已宣告完成
+        declare_topology(channel)
+        self._enable_confirms(channel)
+
+    def _enable_confirms(self, channel):
+        channel.add_on_return_callback(self._on_message_returned)
+        channel.confirm_delivery(
+            self._on_delivery_confirmation,
+            callback=lambda _frame: self._on_channel_ready(channel)
+        )
+
+    def _on_channel_ready(self, channel):
+        logger.info("RabbitMQ 初始化成功")
+        self._channel = channel
+        self._delivery_tag = 0
+        self._flush()
+
+    def _on_channel_closed(self, channel, reason):
+        if self._channel is not channel and self._channel is not None:
+            return
+        self._channel = None
+        self._requeue_unconfirmed()
+        if self._connection is not None and self._connection.is_open:
+            logger.warning(f"發布通道已關閉，{RECONNECT_DELAY} 秒後重新開啟: {str(reason)}")
+            self._connection.ioloop.call_later(RECONNECT_DELAY, self._reopen_channel)
+
+    def _reopen_channel(self):
+        if self._connection is not None and self._connection.is_open:
+            self._connection.channel(on_open_callback=self._on_setup_channel_open)
+
+    def _flush(self):
+        with self._lock:
+            self._flush_scheduled = False
+        if self._channel is None or not self._channel.is_open:
+            return
+        sent = 0
+        for _ in range(self._max_messages):
+            if self._retry:
+                item = self._retry.popleft()
+            else:
+                try:
+                    item = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+            routing_key, message, body, future, _ = item
+            # 呼叫端逾時已取消的請求不再發送；重送的項目已在執行中
+            if not future.running() and not future.set_running_or_notify_cancel():
+                continue
+            if not send_message(self._channel, routing_key, message, body):
+                resolve_future(future, False)
+                continue
+            sent += 1
+            self._delivery_tag += 1
+            self._unconfirmed[self._delivery_tag] = item
+        else:
+            # 本輪已達上限，剩餘的消息在下一輪發送
+            with self._lock:
+                self._flush_scheduled = True
+            self._connection.ioloop.call_later(0, self._flush)
+        if sent:
+            MESSAGES_PUBLISHED.inc(sent)
+            PUBLISH_BATCH_SIZE.observe(sent)
+            UNCONFIRMED_MESSAGES.set(len(self._unconfirmed))
+
+    def _on_delivery_confirmation(self, method_frame):
+        method = method_frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        for tag in tags:
+            item = self._unconfirmed.pop(tag, None)
+            if item is None:
+                continue
+            message = item[1]
+            message_id = message['message_id']
+            returned = message_id in self._returned
+            self._returned.discard(message_id)
+            if not acked:
+                logger.error(f"消息未被 broker 確認: {message_id}")
+                MESSAGES_CONFIRMED.labels(result='nack').inc()
+            elif returned:
+                MESSAGES_CONFIRMED.labels(result='returned').inc()
+            else:
+                MESSAGES_CONFIRMED.labels(result='ack').inc()
+                PUBLISH_CONFIRM_SECONDS.observe((time.time_ns() - message.created_ns) / 1_000_000_000)
+            resolve_future(item[3], acked and not returned)
+        UNCONFIRMED_MESSAGES.set(len(self._unconfirmed))
+
+    def _on_message_returned(self, channel, method, properties, body):
+        logger.error(f"消息無法路由: {method.routing_key} -> {properties.message_id}")
+        self._returned.add(properties.message_id)
+
+    # 未確認的消息重送一次，已重送過或呼叫端已逾時放棄的以失敗完成
+    def _requeue_unconfirmed(self):
+        deadline = time.time_ns() - PUBLISH_TIMEOUT * 1_000_000_000
+        for item in self._unconfirmed.values():
+            if item[4] >= 1 or item[1].created_ns < deadline:
+                resolve_future(item[3], False)
+            else:
+                item[4] += 1
+                self._retry.append(item)
+        self._unconfirmed.clear()
+        self._returned.clear()
+        UNCONFIRMED_MESSAGES.set(0)
+
+    def _fail_waiting(self):
+        while self._retry:
+            resolve_future(self._retry.popleft()[3], False)
+        while True:
+            try:
+                resolve_future(self._pending.get_nowait()[3], False)
+            except queue.Empty:
+                break
+
+# 每個行程一個批次發布器，gunicorn worker 啟動時建立 (見 gunicorn.conf.py)，
+# 其他情況在首次使用時啟動
+_batch_publisher = None
+_batch_publisher_lock = threading.Lock()
+
+def get_batch_publisher():
+    global _batch_publisher
+    with _batch_publisher_lock:
+        if _batch_publisher is None:
+            _batch_publisher = BatchPublisher()
+        return _batch_publisher
+
+# 設定發布結果；呼叫端已取消的 Future 直接略過
+def resolve_future(future, result):
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+# 等待一組發布請求完成，回傳未成功發送的 Future 集合；
+# 逾時的請求會被取消，尚未發送的就不會在之後送出而造成重複消息
+def wait_for_publish(futures, timeout=PUBLISH_TIMEOUT):
+    done, not_done = wait(futures, timeout=timeout)
+    if not_done:
+        logger.error(f"等待消息發送逾時: {len(not_done)} 筆")
+        for future in not_done:
+            future.cancel()
+    return not_done | {future for future in done if future.cancelled() or not future.result()}
+
+# 透過批次發布器發送消息，等待 broker 確認後回傳結果
+def publish_message(routing_key, message, body=None):
+    future = get_batch_publisher().enqueue(routing_key, message, body)
+    return not wait_for_publish([future])
+
 # ------ 消息模板 ------
 
+# 消息模板中固定不變的部分，所有消息共用同一份物件 (視為唯讀，不可修改)。
+# 使用一般 dict 讓序列化器直接處理，不需經過 default 回呼複製
+DEFAULT_EXECUTION_SETTINGS = {
+    "slippage": 0.001,
+    "commission": 0.0003
+}
+DEFAULT_RISK_SETTINGS = {
+    "max_position_size": 0.2,
+    "max_drawdown": 0.1
+}
+DEFAULT_STRATEGY_TAGS = ("example", "test")
+
 # 回測相關消息模板
 def create_backtest_request(strategy_id, start_date, end_date, initial_capital, instruments):
     payload = {
@@ -126,14 +502,8 @@ def create_backtest_request(strategy_id, start_date, end_date, initial_capital,
             "end_date": end_date,
             "initial_capital": initial_capital,
             "instruments": instruments,
-            "execution_settings": {
-                "slippage": 0.001,
-                "commission": 0.0003
-            },
-            "risk_settings": {
-                "max_position_size": 0.2,
-                "max_drawdown": 0.1
-            }
+            "execution_settings": DEFAULT_EXECUTION_SETTINGS,
+            "risk_settings": DEFAULT_RISK_SETTINGS
         }
     }
     return create_message("backtest.request", payload)
@@ -146,7 +516,7 @@ def create_strategy_upload(strategy_id, strategy_name, strategy_code, version="1
         "version": version,
         "code": strategy_code,
         "parameters": {},
-        "tags": ["example", "test"]
+        "tags": DEFAULT_STRATEGY_TAGS
     }
     return create_message("strategy.upload", payload)
 
@@ -160,48 +530,108 @@ def create_data_request(instrument_id, start_date, end_date, frequency="1d"):
     }
     return create_message("data.request", payload)
 
-# 檔案上傳消息模板
-def create_file_upload_message(file_name, file_content_base64, file_type, related_id=None):
+# 檔案上傳消息模板 (文件內容以原始位元組作為消息內容發送，此處僅包含元數據)
+def create_file_upload_message(file_name, file_size, file_type, related_id=None):
     payload = {
         "file_name": file_name,
-        "file_content": file_content_base64,
         "file_type": file_type,
-        "file_size": len(base64.b64decode(file_content_base64)),
-        "related_id": related_id,
-        "upload_time": datetime.now().isoformat()
+        "file_size": file_size,
+        "related_id": related_id
     }
-    return create_message("file.upload", payload)
+    message = create_message("file.upload", payload)
+    # 上傳時間沿用消息建立時間 (UTC)，不再另外讀取時鐘
+    payload["upload_time"] = message["timestamp"]
+    return message
+
+# ------ 請求模型 ------
+
+# 請求模型基底：拒絕未定義的欄位
+class RequestModel(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
+class BacktestRequest(RequestModel):
+    strategy_id: str
+    start_date: str
+    end_date: str
+    initial_capital: float
+    instruments: List[str]
+
+class StrategyUploadRequest(RequestModel):
+    strategy_id: Optional[str] = None
+    strategy_name: Optional[str] = None
+    code: str = ''
+    version: str = '1.0'
+
+class DataRequest(RequestModel):
+    instrument_id: str
+    start_date: str
+    end_date: str
+    frequency: str = '1d'
+
+class CustomMessageRequest(RequestModel):
+    routing_key: str
+    payload: Any
+    message_type: str = 'custom'
+    correlation_id: Optional[str] = None
+
+class BulkMessagesRequest(RequestModel):
+    messages: List[CustomMessageRequest] = Field(min_length=1)
+
+# 以請求模型驗證 JSON 內容 (非 JSON 請求視為空內容，由模型回報錯誤)
+def parse_request(model):
+    return model.model_validate(request.get_json(silent=True))
+
+# 驗證失敗時回傳結構化的錯誤內容
+def validation_error_response(error):
+    return jsonify({
+        "error": "請求參數無效",
+        "details": error.errors(include_url=False, include_context=False, include_input=False)
+    }), 400
+
+# 請求內容超過 MAX_UPLOAD_SIZE 時的回應，所有端點共用
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return jsonify({"error": f"請求內容超過大小上限: {MAX_UPLOAD_SIZE} 位元組"}), 413
 
 # ------ HTTP API 端點 ------
 
+# 健康檢查的固定回應，探測請求不需要 JSON 編碼或讀取時間。
+# 每次回傳時由 Flask 以這些內容建立新的 Response，避免在並發請求間共用同一個可變物件
+HEALTH_RESPONSE_BODY = b'{"status":"ok"}'
+HEALTH_RESPONSE_HEADERS = {
+    "Content-Type": "application/json",
+    "Cache-Control": "no-store"
+}
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "ok", "timestamp": datetime.now().isoformat()})
+    return HEALTH_RESPONSE_BODY, 200, HEALTH_RESPONSE_HEADERS
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
 
 @app.route('/api/backtest', methods=['POST'])
 def backtest_request():
     try:
-        data = request.json
-        
-        # 檢查必要參數
-        required_fields = ['strategy_id', 'start_date', 'end_date', 'initial_capital', 'instruments']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"缺少必要參數: {field}"}), 400
+        data = parse_request(BacktestRequest)
         
         # 創建消息
         message = create_backtest_request(
-            data['strategy_id'],
-            data['start_date'],
-            data['end_date'],
-            data['initial_capital'],
-            data['instruments']
+            data.strategy_id,
+            data.start_date,
+            data.end_date,
+            data.initial_capital,
+            data.instruments
         )
         
-        # 連接 RabbitMQ 並發送消息
-        connection, channel = initialize_rabbitmq()
-        result = send_message(channel, 'backtest.request', message)
-        connection.close()
+        # 透過批次發布器發送消息
+        result = publish_message('backtest.request', message)
         
         if result:
             return jsonify({
@@ -212,6 +642,10 @@ def backtest_request():
         else:
             return jsonify({"error": "發送回測請求失敗"}), 500
     
+    except ValidationError as e:
+        return validation_error_response(e)
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -231,21 +665,19 @@ def strategy_upload():
             
         elif request.is_json:
             # 從JSON處理
-            data = request.json
-            strategy_id = data.get('strategy_id', generate_message_id())
-            strategy_name = data.get('strategy_name', f"Strategy_{strategy_id}")
-            strategy_code = data.get('code', '')
-            version = data.get('version', '1.0')
+            data = parse_request(StrategyUploadRequest)
+            strategy_id = data.strategy_id or generate_message_id()
+            strategy_name = data.strategy_name or f"Strategy_{strategy_id}"
+            strategy_code = data.code
+            version = data.version
         else:
             return jsonify({"error": "無效的請求格式，請提供JSON或檔案"}), 400
         
         # 創建消息
         message = create_strategy_upload(strategy_id, strategy_name, strategy_code, version)
         
-        # 連接 RabbitMQ 並發送消息
-        connection, channel = initialize_rabbitmq()
-        result = send_message(channel, 'strategy.upload', message)
-        connection.close()
+        # 透過批次發布器發送消息
+        result = publish_message('strategy.upload', message)
         
         if result:
             return jsonify({
@@ -256,34 +688,28 @@ def strategy_upload():
         else:
             return jsonify({"error": "發送策略請求失敗"}), 500
     
+    except ValidationError as e:
+        return validation_error_response(e)
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/data/request', methods=['POST'])
 def data_request():
     try:
-        data = request.json
-        
-        # 檢查必要參數
-        required_fields = ['instrument_id', 'start_date', 'end_date']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"缺少必要參數: {field}"}), 400
-        
-        frequency = data.get('frequency', '1d')
+        data = parse_request(DataRequest)
         
         # 創建消息
         message = create_data_request(
-            data['instrument_id'],
-            data['start_date'],
-            data['end_date'],
-            frequency
+            data.instrument_id,
+            data.start_date,
+            data.end_date,
+            data.frequency
         )
         
-        # 連接 RabbitMQ 並發送消息
-        connection, channel = initialize_rabbitmq()
-        result = send_message(channel, 'data.request', message)
-        connection.close()
+        # 透過批次發布器發送消息
+        result = publish_message('data.request', message)
         
         if result:
             return jsonify({
@@ -293,6 +719,10 @@ def data_request():
         else:
             return jsonify({"error": "發送數據請求失敗"}), 500
     
+    except ValidationError as e:
+        return validation_error_response(e)
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -311,69 +741,107 @@ def file_upload():
         file_type = request.form.get('file_type', 'unknown')
         related_id = request.form.get('related_id')
         
-        # 讀取並編碼文件內容
+        # 讀取文件內容 (不做 base64 編碼，直接作為消息內容發送，只保留這一份副本)
         file_content = file.read()
-        file_content_base64 = base64.b64encode(file_content).decode('utf-8')
+        file_size = len(file_content)
         
         # 創建消息
         message = create_file_upload_message(
             file.filename,
-            file_content_base64,
+            file_size,
             file_type,
             related_id
         )
         
-        # 連接 RabbitMQ 並發送消息
-        connection, channel = initialize_rabbitmq()
-        result = send_message(channel, 'file.upload', message)
-        connection.close()
+        # 透過批次發布器發送消息
+        result = publish_message('file.upload', message, file_content)
         
         if result:
             return jsonify({
                 "message": "文件已上傳",
                 "file_name": file.filename,
-                "file_size": len(file_content),
+                "file_size": file_size,
                 "message_id": message['message_id']
             })
         else:
             return jsonify({"error": "發送文件失敗"}), 500
     
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/message/custom', methods=['POST'])
 def custom_message():
     try:
-        data = request.json
-        
-        # 檢查必要參數
-        if 'routing_key' not in data or 'payload' not in data:
-            return jsonify({"error": "缺少必要參數: routing_key 和 payload"}), 400
+        data = parse_request(CustomMessageRequest)
         
         # 創建自定義消息
         message = create_message(
-            data.get('message_type', 'custom'),
-            data['payload'],
-            data.get('correlation_id')
+            data.message_type,
+            data.payload,
+            data.correlation_id
         )
         
-        # 連接 RabbitMQ 並發送消息
-        connection, channel = initialize_rabbitmq()
-        result = send_message(channel, data['routing_key'], message)
-        connection.close()
+        # 透過批次發布器發送消息
+        result = publish_message(data.routing_key, message)
         
         if result:
             return jsonify({
                 "message": "自定義消息已發送",
                 "message_id": message['message_id'],
-                "routing_key": data['routing_key']
+                "routing_key": data.routing_key
             })
         else:
             return jsonify({"error": "發送自定義消息失敗"}), 500
     
+    except ValidationError as e:
+        return validation_error_response(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/messages/bulk', methods=['POST'])
+def bulk_messages():
+    try:
+        data = parse_request(BulkMessagesRequest)
+        
+        # 創建消息並全部交給批次發布器，再一起等待確認結果
+        publisher = get_batch_publisher()
+        futures = {}
+        for entry in data.messages:
+            message = create_message(
+                entry.message_type,
+                entry.payload,
+                entry.correlation_id
+            )
+            futures[publisher.enqueue(entry.routing_key, message)] = message['message_id']
+        failed = wait_for_publish(futures)
+        
+        if not failed:
+            return jsonify({
+                "message": "批次消息已發送",
+                "message_ids": list(futures.values())
+            })
+        else:
+            return jsonify({
+                "error": "部分批次消息發送失敗",
+                "failed_message_ids": [futures[future] for future in failed]
+            }), 500
+    
+    except ValidationError as e:
+        return validation_error_response(e)
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# 僅供本機開發使用，正式環境以 gunicorn 啟動 (見 gunicorn.conf.py)
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    # 啟動時預先建立連接並確認拓撲 (debug 模式下 reloader 的監控行程不建立連接)
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_batch_publisher()
+    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
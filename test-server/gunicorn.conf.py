@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+import shutil
+
+# 所有端點都在等待 RabbitMQ 的網路 I/O，使用 gevent worker 讓單一 worker 同時處理大量請求。
+# 每個請求是一個 greenlet，發送後只在 Future 上等待 broker 確認，不佔用執行緒；
+# 因此並發上限由 worker_connections 決定，而不是執行緒池大小
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = 'gevent'
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# 每個 worker 載入應用後立即建立自己的 RabbitMQ 連接和發布執行緒。
+# 不在 post_fork 中建立，因為此時應用尚未載入，gevent 也還沒完成 monkey patch
+def post_worker_init(worker):
+    from app import get_batch_publisher
+    get_batch_publisher()
+
+# 使用 PROMETHEUS_MULTIPROC_DIR 時，prometheus_client 要求啟動時目錄存在且為空，
+# 在 master 啟動 (worker 尚未載入應用) 時建立並清空，避免沿用上次執行的指標檔
+def on_starting(server):
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir)
+
+# 使用 PROMETHEUS_MULTIPROC_DIR 時，清除已結束 worker 的即時指標
+def child_exit(server, worker):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,182 @@
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+import app
+
+
+# 模擬 SelectConnection 的 IOLoop：記錄排程的回呼，由測試決定何時執行
+class FakeIOLoop:
+    def __init__(self):
+        self.scheduled = []
+
+    def call_later(self, delay, callback):
+        self.scheduled.append((delay, callback))
+
+    def add_callback_threadsafe(self, callback):
+        self.scheduled.append((0, callback))
+
+    def run_scheduled(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for _delay, callback in scheduled:
+            callback()
+
+
+# 模擬發布通道：記錄呼叫的方法，開啟後立即完成 confirm_delivery
+class FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.calls = []
+        self.published = []
+        self.close_callbacks = []
+
+    def add_on_close_callback(self, callback):
+        self.close_callbacks.append(callback)
+
+    def add_on_return_callback(self, callback):
+        self.calls.append('add_on_return_callback')
+
+    def exchange_declare(self, **kwargs):
+        self.calls.append(('exchange_declare', kwargs.get('exchange')))
+
+    def queue_declare(self, **kwargs):
+        self.calls.append(('queue_declare', kwargs.get('queue')))
+
+    def queue_bind(self, **kwargs):
+        self.calls.append(('queue_bind', kwargs.get('queue'), kwargs.get('routing_key')))
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self.calls.append('confirm_delivery')
+        callback(None)
+
+    def basic_publish(self, **kwargs):
+        self.published.append(kwargs)
+
+    def close_by_broker(self, reply_code, reply_text):
+        self.is_open = False
+        reason = pika.exceptions.ChannelClosedByBroker(reply_code, reply_text)
+        for callback in self.close_callbacks:
+            callback(self, reason)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.is_open = True
+        self.ioloop = FakeIOLoop()
+        self.channels = []
+
+    def channel(self, on_open_callback):
+        channel = FakeChannel()
+        self.channels.append(channel)
+        on_open_callback(channel)
+        return channel
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    # 不啟動真正的連接執行緒，改由測試直接驅動回呼
+    monkeypatch.setattr(app.BatchPublisher, '_run', lambda self: None)
+    publisher = app.BatchPublisher()
+    connection = FakeConnection()
+    publisher._connection = connection
+    publisher._on_connection_open(connection)
+    return publisher
+
+
+def enqueue(publisher, count, routing_key='backtest.request'):
+    futures = [
+        publisher.enqueue(routing_key, app.create_message('backtest.request', {"n": i}))
+        for i in range(count)
+    ]
+    # 直接發送，捨棄 enqueue 排程的批次窗口
+    publisher._flush()
+    publisher._connection.ioloop.scheduled.clear()
+    return futures
+
+
+def confirm(publisher, method):
+    publisher._on_delivery_confirmation(SimpleNamespace(method=method))
+
+
+def test_channel_open_declares_topology_before_confirms(publisher):
+    calls = publisher._connection.channels[0].calls
+    assert ('queue_bind', app.FILE_QUEUE, 'file.*') in calls
+    assert calls.index(('exchange_declare', app.EXCHANGE_NAME)) < calls.index('confirm_delivery')
+    assert calls[-1] == 'confirm_delivery'
+    assert publisher._channel is publisher._connection.channels[0]
+
+
+def test_multiple_ack_confirms_all_messages_up_to_tag(publisher):
+    futures = enqueue(publisher, 3)
+    confirm(publisher, pika.spec.Basic.Ack(delivery_tag=2, multiple=True))
+    assert [future.done() for future in futures] == [True, True, False]
+    assert futures[0].result() and futures[1].result()
+
+    confirm(publisher, pika.spec.Basic.Ack(delivery_tag=3))
+    assert futures[2].result() is True
+    assert not publisher._unconfirmed
+
+
+def test_nack_resolves_false(publisher):
+    future, = enqueue(publisher, 1)
+    confirm(publisher, pika.spec.Basic.Nack(delivery_tag=1))
+    assert future.result() is False
+
+
+def test_returned_message_resolves_false_after_ack(publisher):
+    future, = enqueue(publisher, 1, routing_key='unbound.key')
+    message_id = publisher._connection.channels[0].published[0]['properties'].message_id
+    publisher._on_message_returned(
+        publisher._channel,
+        SimpleNamespace(routing_key='unbound.key'),
+        SimpleNamespace(message_id=message_id),
+        b''
+    )
+    confirm(publisher, pika.spec.Basic.Ack(delivery_tag=1))
+    assert future.result() is False
+    assert not publisher._returned
+
+
+def test_channel_close_requeues_in_flight_message_once(publisher):
+    connection = publisher._connection
+    future, = enqueue(publisher, 1)
+
+    connection.channels[0].close_by_broker(404, 'NOT_FOUND')
+    assert not future.done()
+    assert publisher._channel is None
+    assert not publisher._unconfirmed
+    # 重新開啟通道前先等待 RECONNECT_DELAY
+    assert [delay for delay, _ in connection.ioloop.scheduled] == [app.RECONNECT_DELAY]
+
+    connection.ioloop.run_scheduled()
+    assert len(connection.channels) == 2
+    assert len(connection.channels[1].published) == 1
+    assert publisher._delivery_tag == 1
+
+    connection.channels[1].close_by_broker(404, 'NOT_FOUND')
+    assert future.result() is False
+    connection.ioloop.run_scheduled()
+    assert len(connection.channels[2].published) == 0
+
+
+def test_cancelled_future_is_skipped_by_flush(publisher):
+    message = app.create_message('backtest.request', {})
+    cancelled = publisher.enqueue('backtest.request', message)
+    assert cancelled.cancel()
+    kept, = enqueue(publisher, 1)
+
+    published = publisher._connection.channels[0].published
+    assert len(published) == 1
+    assert published[0]['properties'].message_id != message['message_id']
+    assert cancelled.cancelled()
+    assert list(publisher._unconfirmed.values())[0][3] is kept
+
+
+def test_wait_for_publish_cancels_timed_out_futures(publisher):
+    future = publisher.enqueue('backtest.request', app.create_message('backtest.request', {}))
+    assert app.wait_for_publish([future], timeout=0) == {future}
+    assert future.cancelled()
+
+    publisher._flush()
+    assert not publisher._connection.channels[0].published